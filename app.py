@@ -1,22 +1,12 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import os
-import subprocess
-import sys
-
-# --- FORCE INSTALL PLOTLY ---
-# This ensures Plotly is installed even if requirements.txt fails or is missing
-try:
-    import plotly.express as px
-    import plotly.graph_objects as go
-except ImportError:
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "plotly"])
-    import plotly.express as px
-    import plotly.graph_objects as go
-# ---------------------------
-
-from datetime import datetime, timedelta
+import plotly.express as px
+import plotly.graph_objects as go
+import altair as alt
+
+import time
+from datetime import datetime
 
 # --- CONFIGURATION & PAGE SETUP ---
 st.set_page_config(
@@ -26,7 +16,7 @@ st.set_page_config(
 )
 
 # --- CSS STYLING (UPDATED COLORS) ---
-st.markdown("""
+CSS = """
 <style>
     /* Metric Card Styling */
     .metric-card {
@@ -64,99 +54,243 @@ st.markdown("""
         color: white;              /* Text Color */
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Alert card markup for the headline (most severe) alert
+CARD_TMPL = """<div class="metric-card">
+<h4>{Severity} | {Rule}</h4>
+<p><b>{msg_label}:</b> {Message}</p>
+<p><b>{action_label}:</b> {Action}</p>
+</div>"""
+
+# Emitted on every rerun: Streamlit drops elements that a rerun doesn't re-create
+st.markdown(CSS, unsafe_allow_html=True)
 
 # --- 1. DATA GENERATOR (SIMULATION MODE) ---
-def generate_data(scenario="Normal"):
+# Seconds a simulated day stays cached before it is regenerated
+SIM_TTL = 60
+
+# Module-level PCG64 generator (faster than the legacy global np.random state)
+_RNG = np.random.default_rng()
+
+# Scenario Injection Logic (slice writes on the raw arrays, before the DataFrame exists)
+def _inject_zero_conversions(arrs):
+    arrs['conversions'][-16:] = 0
+    arrs['spend'][-16:] = 600
+
+def _inject_overspend(arrs):
+    arrs['spend'][-10:] = 3000
+
+def _inject_cpm_spike(arrs):
+    arrs['impressions'][-8:] = 500
+    arrs['spend'][-8:] = 800
+
+def _inject_ctr_drop(arrs):
+    arrs['clicks'][-20:] = 10
+
+SCENARIO_INJECTORS = {
+    "Rule A: Zero Conversions (Broken Pixel)": _inject_zero_conversions,
+    "Rule B: Pacing Breach (Overspend)": _inject_overspend,
+    "Rule C: Cost Spike (High CPM)": _inject_cpm_spike,
+    "Rule D: Quality Drop (Low CTR)": _inject_ctr_drop,
+}
+
+SCENARIOS = ["Normal", *SCENARIO_INJECTORS]
+
+# Derived Metrics (plain NumPy, no Series alignment); only the requested columns are computed
+def _add_metrics(arrs, cols):
+    spend = arrs['spend']
+    if 'cpm' in cols or 'ctr' in cols:
+        impressions = arrs['impressions']
+        has_impr = impressions != 0
+    if 'cpm' in cols:
+        arrs['cpm'] = np.divide(spend, impressions, out=np.full_like(spend, np.nan), where=has_impr) * 1000
+    if 'ctr' in cols:
+        clicks = arrs['clicks']
+        arrs['ctr'] = np.divide(clicks, impressions, out=np.full_like(clicks, np.nan), where=has_impr) * 100
+    if 'cpa' in cols:
+        conv = arrs['conversions']
+        arrs['cpa'] = np.divide(spend, conv, out=np.full_like(spend, np.nan), where=conv != 0)
+
+def _simulate(scenario="Normal", needed=('cpm', 'ctr')):
+    """
+    Columnar simulation: returns (dates, arrs) where arrs maps column -> ndarray.
+    needed: derived metric columns to compute ('cpm', 'ctr', 'cpa').
+    The dashboard never reads CPA, so it is skipped by default.
+    """
     dates = pd.date_range(end=datetime.now(), periods=24*4, freq='15T')
     
-    data = {
-        'timestamp': dates,
-        'spend': np.random.normal(500, 50, size=len(dates)), 
-        'impressions': np.random.normal(5000, 500, size=len(dates)),
-        'clicks': np.random.normal(150, 20, size=len(dates)),
-        'conversions': np.random.randint(0, 5, size=len(dates))
-    }
+    # One vectorized draw for all three normal columns; float32/int32 halve the
+    # bytes moved by every reduction and chart serialization
+    z = _RNG.standard_normal((len(dates), 3), dtype=np.float32)
     
-    df = pd.DataFrame(data)
+    arrs = {
+        'spend': 500 + 50 * z[:, 0], 
+        'impressions': 5000 + 500 * z[:, 1],
+        'clicks': 150 + 20 * z[:, 2],
+        'conversions': _RNG.integers(0, 5, size=len(dates), dtype=np.int32)
+    }
     
-    # Scenario Injection Logic
-    if scenario == "Rule A: Zero Conversions (Broken Pixel)":
-        df.loc[df.index[-16:], 'conversions'] = 0
-        df.loc[df.index[-16:], 'spend'] = 600 
+    inject = SCENARIO_INJECTORS.get(scenario)
+    if inject is not None:
+        inject(arrs)
 
-    elif scenario == "Rule B: Pacing Breach (Overspend)":
-        df.loc[df.index[-10:], 'spend'] = 3000 
+    _add_metrics(arrs, needed)
     
-    elif scenario == "Rule C: Cost Spike (High CPM)":
-        df.loc[df.index[-8:], 'impressions'] = 500
-        df.loc[df.index[-8:], 'spend'] = 800
+    return dates, arrs
 
-    elif scenario == "Rule D: Quality Drop (Low CTR)":
-        df.loc[df.index[-20:], 'clicks'] = 10 
+# Baseline for Rules C/D: the 16 periods (4h) just before the current 4h window, so
+# short spikes (Rule C's 2h) stay out of their own baseline. Longer runs still leak in
+# (Rule D's 5h drop covers the last 4 baseline periods) but only dilute it.
+BASELINE_WINDOW = 16
 
-    # Derived Metrics
-    df['cpm'] = (df['spend'] / df['impressions']) * 1000
-    df['ctr'] = (df['clicks'] / df['impressions']) * 100
-    df['cpa'] = df['spend'] / df['conversions'].replace(0, np.nan) 
-    
-    return df
+# Cached per scenario so widget interactions don't regenerate the data on every rerun
+@st.cache_data(ttl=SIM_TTL, max_entries=8)
+def build_sim_metrics(scenario="Normal"):
+    """
+    Returns (df, metrics, generated_at) for the simulation dashboard, cached per
+    scenario; generated_at (time.time()) lets per-session memos expire in step
+    with this cache
+    """
+    dates, arrs = _simulate(scenario)
+
+    # Prepare Metrics for Logic Engine straight from the arrays (a batch of one
+    # campaign); pandas is only built afterwards for the charts
+    batch = campaign_metrics({k: v[None] for k, v in arrs.items()})
+    metrics = {k: (v[0] if np.ndim(v) else v) for k, v in batch.items()}
+
+    df = pd.DataFrame({'timestamp': dates, **arrs}, copy=False)
+
+    return df, metrics, time.time()
 
 # --- 2. LOGIC ENGINE (SHARED) ---
+# (Tier, Rule, Severity, Message template, Action) -- formatted with the metrics dict,
+# and only for rules that actually fire
+RULE_TEMPLATES = (
+    # --- TIER 1: KILL SWITCH ---
+    ("Tier 1: Kill Switch", "Rule A (Zero Conversions)", "Critical (P0)",
+     "ZERO conversions in last 4h despite spending ₹{spend_last_4h:,.2f}.",
+     "Check Landing Page / Pixel"),
+    ("Tier 1: Kill Switch", "Rule B (Pacing Breach)", "Critical (P0)",
+     "Daily spend ₹{daily_spend:,.2f} exceeded budget limit (₹{daily_budget}) by >20%.",
+     "Pause Campaign / Check Bids"),
+    # --- TIER 2: TREND WATCH ---
+    ("Tier 2: Trend Watch", "Rule C (CPM Spike)", "High (P1)",
+     "Current CPM (₹{current_cpm:.2f}) is >50% above average (₹{avg_cpm:.2f}).",
+     "Check Auction Competition"),
+    ("Tier 2: Trend Watch", "Rule D (CTR Drop)", "Medium (P2)",
+     "Current CTR ({current_ctr:.2f}%) dropped >50% below average ({avg_ctr:.2f}%).",
+     "Check Creative Fatigue"),
+)
+
+def _make_alert(i, metrics):
+    tier, rule, severity, msg_fmt, action = RULE_TEMPLATES[i]
+    return {
+        "Tier": tier,
+        "Rule": rule,
+        "Severity": severity,
+        "Message": msg_fmt.format(**metrics),
+        "Action": action
+    }
+
+def rule_flags(metrics):
+    """
+    One flag per RULE_TEMPLATES entry. Uses `&` rather than `and` so the same
+    predicates work on scalars (one campaign) and on per-campaign arrays.
+    """
+    return [
+        # Rule A: Zero Conversions
+        (metrics['spend_last_4h'] > 5000) & (metrics['conv_last_4h'] == 0),
+        # Rule B: Pacing Breach
+        metrics['daily_spend'] > metrics['daily_budget'] * 1.2,
+        # Rule C: Cost Spike (CPM)
+        metrics['current_cpm'] > metrics['avg_cpm'] * 1.5,
+        # Rule D: Quality Drop (CTR)
+        metrics['current_ctr'] < metrics['avg_ctr'] * 0.5,
+    ]
+
 def run_logic_checks(metrics):
     """
     metrics: dict containing all necessary data points
     """
-    alerts = []
-    
-    # --- TIER 1: KILL SWITCH ---
-    
-    # Rule A: Zero Conversions
-    if metrics['spend_last_4h'] > 5000 and metrics['conv_last_4h'] == 0:
-        alerts.append({
-            "Tier": "Tier 1: Kill Switch",
-            "Rule": "Rule A (Zero Conversions)",
-            "Severity": "Critical (P0)",
-            "Message": f"ZERO conversions in last 4h despite spending ₹{metrics['spend_last_4h']:,.2f}.",
-            "Action": "Check Landing Page / Pixel"
-        })
-
-    # Rule B: Pacing Breach
-    limit = metrics['daily_budget'] * 1.2
-    if metrics['daily_spend'] > limit:
-        alerts.append({
-            "Tier": "Tier 1: Kill Switch",
-            "Rule": "Rule B (Pacing Breach)",
-            "Severity": "Critical (P0)",
-            "Message": f"Daily spend ₹{metrics['daily_spend']:,.2f} exceeded budget limit (₹{metrics['daily_budget']}) by >20%.",
-            "Action": "Pause Campaign / Check Bids"
-        })
+    fired = rule_flags(metrics)
 
-    # --- TIER 2: TREND WATCH ---
-    
-    # Rule C: Cost Spike (CPM)
-    if metrics['current_cpm'] > (metrics['avg_cpm'] * 1.5):
-        alerts.append({
-            "Tier": "Tier 2: Trend Watch",
-            "Rule": "Rule C (CPM Spike)",
-            "Severity": "High (P1)",
-            "Message": f"Current CPM (₹{metrics['current_cpm']:.2f}) is >50% above average (₹{metrics['avg_cpm']:.2f}).",
-            "Action": "Check Auction Competition"
-        })
-
-    # Rule D: Quality Drop (CTR)
-    if metrics['current_ctr'] < (metrics['avg_ctr'] * 0.5):
-        alerts.append({
-            "Tier": "Tier 2: Trend Watch",
-            "Rule": "Rule D (CTR Drop)",
-            "Severity": "Medium (P2)",
-            "Message": f"Current CTR ({metrics['current_ctr']:.2f}%) dropped >50% below average ({metrics['avg_ctr']:.2f}%).",
-            "Action": "Check Creative Fatigue"
-        })
-
-    return alerts
-
-# --- 3. FRONTEND UI ---
+    return [_make_alert(i, metrics) for i, f in enumerate(fired) if f]
+
+def campaign_metrics(arrs, daily_budget=50000):
+    """
+    Simulation metrics for a batch of campaigns: arrs maps column -> 2D array of
+    shape (n_campaigns, n_periods). Every reduction runs along the period axis,
+    so adding campaigns adds array width, not Python calls; the results feed
+    straight into rule_flags.
+    """
+    spend, conv = arrs['spend'], arrs['conversions']
+    cpm, ctr = arrs['cpm'], arrs['ctr']
+    baseline = slice(-16 - BASELINE_WINDOW, -16)
+
+    return {
+        'spend_last_4h': spend[:, -16:].sum(axis=1),
+        'conv_last_4h': conv[:, -16:].sum(axis=1),
+        'daily_spend': spend.sum(axis=1),
+        'daily_budget': daily_budget,
+        'current_cpm': cpm[:, -1],
+        'avg_cpm': cpm[:, baseline].mean(axis=1),
+        'current_ctr': ctr[:, -1],
+        'avg_ctr': ctr[:, baseline].mean(axis=1)
+    }
+
+# --- 3. CHART BUILDERS (CACHED) ---
+# Only charts that need Plotly (dual axis, annotated area) are built here; the rest
+# use Streamlit/Altair. Figures are keyed on a cheap signature of the data (len, last
+# timestamp, scenario) with the DataFrame passed as an unhashed `_df` argument, and
+# held via cache_resource since pickling a Figure on every hit re-validates it.
+# Callers must not mutate the returned figure.
+def df_signature(df, scenario):
+    return (len(df), df['timestamp'].to_numpy()[-1], scenario)
+
+@st.cache_resource(max_entries=8)
+def build_spend_conv_fig(df_sig, _df):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=_df['timestamp'], y=_df['spend'], name="Spend (₹)", line=dict(color='blue')))
+    fig.add_trace(go.Scatter(x=_df['timestamp'], y=_df['conversions'], name="Conversions", yaxis='y2', line=dict(color='green')))
+    fig.update_layout(yaxis2=dict(overlaying='y', side='right'), title="Spend vs Conversions (Last 24h)")
+    return fig
+
+@st.cache_resource(max_entries=8)
+def build_cumulative_spend_fig(df_sig, _df, budget_limit):
+    cum = np.cumsum(_df['spend'].to_numpy())
+    fig = px.area(x=_df['timestamp'], y=cum, title="Daily Cumulative Spend",
+                  labels={'x': 'timestamp', 'y': 'cumulative_spend'})
+    fig.add_hline(y=budget_limit, line_color="red", annotation_text="Budget Kill Switch")
+    return fig
+
+# --- 4. FRONTEND UI ---
+
+def render_alerts(alerts, msg_label, action_label):
+    """
+    Most severe alert as a card (RULE_TEMPLATES is ordered by severity, so that's
+    alerts[0]); any others go into a single table rather than one card each
+    """
+    st.markdown(CARD_TMPL.format(msg_label=msg_label, action_label=action_label, **alerts[0]),
+                unsafe_allow_html=True)
+    if len(alerts) > 1:
+        st.dataframe(pd.DataFrame(alerts[1:])[['Severity', 'Rule', 'Message', 'Action']],
+                     use_container_width=True, hide_index=True)
+
+def get_sim_state(scenario):
+    """
+    Per-session memo of (df, metrics, alerts) for a scenario, so reruns triggered
+    elsewhere on the page skip the simulation path (and its cache hashing) entirely.
+    Entries expire SIM_TTL after the data was generated, like the data cache. The
+    returned df is shared across reruns and must not be mutated.
+    """
+    sim_cache = st.session_state.setdefault("sim_cache", {})
+    entry = sim_cache.get(scenario)
+    if entry is None or time.time() - entry[0] > SIM_TTL:
+        df, metrics, generated_at = build_sim_metrics(scenario)
+        entry = (generated_at, df, metrics, run_logic_checks(metrics))
+        sim_cache[scenario] = entry
+    return entry[1:]
 
 st.title("🛡️ Proactive Ad Anomaly Detector")
 
@@ -171,75 +305,36 @@ with tab1:
     
     with col_ctrl:
         st.subheader("Simulation Controls")
-        selected_scenario = st.selectbox(
-            "Inject Failure Scenario",
-            [
-                "Normal",
-                "Rule A: Zero Conversions (Broken Pixel)",
-                "Rule B: Pacing Breach (Overspend)",
-                "Rule C: Cost Spike (High CPM)",
-                "Rule D: Quality Drop (Low CTR)"
-            ]
-        )
+        selected_scenario = st.selectbox("Inject Failure Scenario", SCENARIOS)
         st.info("Select a scenario to generate synthetic data and trigger the Logic Engine.")
 
     with col_main:
-        # Generate Data
-        df = generate_data(selected_scenario)
-        
-        # Prepare Metrics for Logic Engine
-        current_data = df.iloc[-1]
-        last_4h_data = df.iloc[-16:]
-        
-        sim_metrics = {
-            'spend_last_4h': last_4h_data['spend'].sum(),
-            'conv_last_4h': last_4h_data['conversions'].sum(),
-            'daily_spend': df['spend'].sum(),
-            'daily_budget': 50000,
-            'current_cpm': current_data['cpm'],
-            'avg_cpm': df['cpm'].mean(),
-            'current_ctr': current_data['ctr'],
-            'avg_ctr': df['ctr'].mean()
-        }
-
-        alerts = run_logic_checks(sim_metrics)
+        # Generate Data + Metrics + Alerts (memoized per scenario for this session)
+        df, sim_metrics, alerts = get_sim_state(selected_scenario)
 
         # Display Alerts
         if alerts:
             st.error(f"⚠️ {len(alerts)} Active Anomalies Detected")
-            for alert in alerts:
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h4>{alert['Severity']} | {alert['Rule']}</h4>
-                    <p><b>Diagnosis:</b> {alert['Message']}</p>
-                    <p><b>Action:</b> {alert['Action']}</p>
-                </div>
-                """, unsafe_allow_html=True)
+            render_alerts(alerts, "Diagnosis", "Action")
         else:
             st.success("✅ System Nominal. No anomalies detected.")
 
         # Charts
         st.divider()
+        df_sig = df_signature(df, selected_scenario)
         if "Zero Conversions" in selected_scenario:
-            fig = go.Figure()
-            fig.add_trace(go.Scatter(x=df['timestamp'], y=df['spend'], name="Spend (₹)", line=dict(color='blue')))
-            fig.add_trace(go.Scatter(x=df['timestamp'], y=df['conversions'], name="Conversions", yaxis='y2', line=dict(color='green')))
-            fig.update_layout(yaxis2=dict(overlaying='y', side='right'), title="Spend vs Conversions (Last 24h)")
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(build_spend_conv_fig(df_sig, df), use_container_width=True)
         elif "CPM" in selected_scenario:
-            threshold = df['cpm'].mean() * 1.5
-            fig = px.line(df, x='timestamp', y='cpm', title="CPM Trend vs Threshold")
-            fig.add_hline(y=threshold, line_dash="dash", line_color="red")
-            st.plotly_chart(fig, use_container_width=True)
+            threshold = sim_metrics['avg_cpm'] * 1.5
+            line = alt.Chart(df, title="CPM Trend vs Threshold").mark_line().encode(x='timestamp:T', y='cpm:Q')
+            rule = alt.Chart(pd.DataFrame({'y': [threshold]})).mark_rule(color='red', strokeDash=[5, 5]).encode(y='y:Q')
+            st.altair_chart(line + rule, use_container_width=True)
         elif "Overspend" in selected_scenario:
-            df['cumulative_spend'] = df['spend'].cumsum()
             budget_limit = 50000 * 1.2
-            fig = px.area(df, x='timestamp', y='cumulative_spend', title="Daily Cumulative Spend")
-            fig.add_hline(y=budget_limit, line_color="red", annotation_text="Budget Kill Switch")
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(build_cumulative_spend_fig(df_sig, df, budget_limit), use_container_width=True)
         else:
-            fig = px.line(df, x='timestamp', y=['spend', 'cpm', 'ctr'], title="Campaign Health Metrics")
-            st.plotly_chart(fig, use_container_width=True)
+            st.markdown("##### Campaign Health Metrics")
+            st.line_chart(df.set_index('timestamp')[['spend', 'cpm', 'ctr']])
 
 # ==========================================
 # TAB 2: MANUAL TEST LAB
@@ -293,14 +388,7 @@ with tab2:
         
         if manual_alerts:
             st.error(f"⚠️ {len(manual_alerts)} Rules Triggered!")
-            for alert in manual_alerts:
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h4>{alert['Severity']} | {alert['Rule']}</h4>
-                    <p><b>Trigger:</b> {alert['Message']}</p>
-                    <p><b>System Action:</b> {alert['Action']}</p>
-                </div>
-                """, unsafe_allow_html=True)
+            render_alerts(manual_alerts, "Trigger", "System Action")
         else:
             st.success("✅ No Anomalies Detected. Data is within normal parameters.")
             st.balloons()